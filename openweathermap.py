@@ -1,8 +1,17 @@
+import json
+import logging
 import os
-from typing import List, Dict, Any
+import time
+from functools import lru_cache
+from typing import TYPE_CHECKING, List, Dict, Any, Callable, Optional, Tuple
 
 import requests
-from PIL import Image
+from requests.adapters import HTTPAdapter
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+logger = logging.getLogger(__name__)
 
 
 class OpenWeatherMap:
@@ -13,33 +22,139 @@ class OpenWeatherMap:
     GEOCODING_API = (
         API_BASE + "/geo/1.0/direct?q={location}&limit=1&appid={api_key}"
     )
+    USER_AGENT = "weatherscreen"
+
+    # Responses are kept in memory and on disk, so that a restart within
+    # the TTL does not need to go back to the network.
+    CACHE_DIR = "/var/tmp/weatherscreen"
+    CURRENT_TTL = 300
+    FORECAST_TTL = 1800
 
-    def __init__(self):
+    def __init__(self, current_ttl: float = CURRENT_TTL):
+        self.current_ttl = current_ttl
         self.lat = float(os.environ.get("LATITUDE") or input("Latitude: "))
         self.lon = float(os.environ.get("LONGITUDE") or input("Longitude: "))
         self.api_key = os.environ.get("WEATHER_API_KEY") or input("API Key: ")
 
+        params = dict(lat=self.lat, lon=self.lon, api_key=self.api_key)
+        self.current_url = self.CURRENT_WEATHER_API.format_map(params)
+        self.forecast_url = self.FORECAST_API.format_map(params)
+
+        # Reuse one connection pool for every request so that polls can
+        # skip the TCP and TLS handshakes while the connection is alive.
+        self.session = requests.Session()
+        self.session.headers.update({"User-Agent": self.USER_AGENT})
+        self.session.mount(
+            "https://", HTTPAdapter(pool_connections=2, pool_maxsize=4)
+        )
+
+        self._cache: Dict[str, Tuple[float, Any]] = {}
+
     def current(self) -> Dict[str, Any]:
-        url = self.CURRENT_WEATHER_API.format(
-            lat=self.lat, lon=self.lon, api_key=self.api_key
+        return self._cached_get(
+            "current", self.current_url, self.current_ttl, self.slim
         )
-        resp = requests.get(url, timeout=1)
-        assert resp.status_code == 200
-        data = resp.json()
-        return data
 
     def forecasts(self) -> List[Dict[str, Any]]:
-        url = self.FORECAST_API.format(
-            lat=self.lat, lon=self.lon, api_key=self.api_key
+        return self._cached_get(
+            "forecasts",
+            self.forecast_url,
+            self.FORECAST_TTL,
+            lambda data: [self.slim(item) for item in data["list"]],
+            self.forecasts_current,
+        )
+
+    @staticmethod
+    def forecasts_current(
+        fetched: float, forecasts: List[Dict[str, Any]]
+    ) -> bool:
+        # Once the first forecast is in the past, a newer list will have
+        # moved on by a slot, unless it was already past when fetched.
+        if not forecasts:
+            return True
+        first = forecasts[0]["dt"]
+        return first >= time.time() or fetched >= first
+
+    def _cached_get(
+        self,
+        name: str,
+        url: str,
+        ttl: float,
+        parse: Callable[[Any], Any],
+        valid: Optional[Callable[[float, Any], bool]] = None,
+    ) -> Any:
+        """Return ``parse`` of the JSON at ``url``, using a cached copy if
+        it was fetched less than ``ttl`` seconds ago and, given its fetch
+        time, passes ``valid``."""
+        now = time.time()
+        cached = self._cache.get(name)
+        if (
+            cached is not None
+            and now - cached[0] < ttl
+            and (valid is None or valid(*cached))
+        ):
+            return cached[1]
+
+        path = os.path.join(
+            self.CACHE_DIR, f"{name}_{self.lat}_{self.lon}.json"
         )
-        resp = requests.get(url, timeout=1)
+        try:
+            fetched = os.path.getmtime(path)
+            if now - fetched < ttl:
+                with open(path, "rb") as f:
+                    result = parse(json.load(f))
+                if valid is None or valid(fetched, result):
+                    self._cache[name] = (fetched, result)
+                    return result
+        except (OSError, ValueError, KeyError, IndexError):
+            pass
+
+        resp = self.session.get(url, timeout=1)
         assert resp.status_code == 200
-        data = resp.json()
-        forecasts = data["list"]
-        return forecasts
+        result = parse(resp.json())
+        self._cache[name] = (now, result)
+
+        try:
+            os.makedirs(self.CACHE_DIR, exist_ok=True)
+            with open(path + ".tmp", "wb") as f:
+                f.write(resp.content)
+            os.replace(path + ".tmp", path)
+        except OSError as exc:
+            logger.warning("Could not cache %s: %s", name, exc)
 
+        return result
+
+    @staticmethod
+    def slim(data: Dict[str, Any]) -> Dict[str, Any]:
+        # Flatten each entry down to the fields that the views display, so
+        # that the rest of the (rather large) API response can be freed and
+        # redraws need one lookup per field.
+        main = data["main"]
+        weather = {
+            "dt": data["dt"],
+            "temp": main["temp"],
+            "feels_like": main["feels_like"],
+            "humidity": main["humidity"],
+            "icon": data["weather"][0]["icon"],
+        }
+        if "name" in data:
+            weather["name"] = data["name"]
+        return weather
+
+    # There are only eighteen icon codes and two sizes, so this cache never
+    # evicts. The cached images are shared, so treat them as read-only.
     @classmethod
-    def icon(cls, code: str) -> Image.Image:
-        return Image.open(
+    @lru_cache(maxsize=64)
+    def icon(cls, code: str, size: int) -> "Image.Image":
+        # The icon is resampled once, with the best filter, and composited
+        # onto black so that it can be pasted onto a black background
+        # without a mask. Only the final image is kept.
+        from PIL import Image
+
+        with Image.open(
             os.path.join(os.path.dirname(__file__), "icons", f"{code}@2x.png")
-        )
+        ) as img:
+            icon = img.convert("RGBA").resize((size, size), Image.LANCZOS)
+        flat = Image.new("RGB", icon.size)
+        flat.paste(icon, mask=icon)
+        return flat
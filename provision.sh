@@ -18,4 +18,32 @@ fi
 cd weatherscreen
 git pull --force
 pip install -r requirements.txt
+
+# Pillow-SIMD is a drop-in replacement for Pillow with vectorised resize,
+# paste and composite loops. Those kernels are SSE4/AVX2 only, so on a Pi
+# the build may fail or gain little; it is opt-in: PILLOW_SIMD=1
+# ./provision.sh
+if [ "${PILLOW_SIMD:-0}" = "1" ]; then
+  sudo apt install -y libjpeg-dev zlib1g-dev libpng-dev libfreetype6-dev
+  # Pillow-SIMD has no NEON code of its own, but on 32-bit Raspberry Pi OS
+  # this lets GCC auto-vectorise the plain C loops with NEON. On aarch64
+  # NEON is always available and -mfpu isn't accepted.
+  if [ "$(uname -m)" = "armv7l" ]; then
+    export CFLAGS="-mfpu=neon"
+  fi
+  # Build the wheel before touching Pillow, so that a failed build leaves
+  # the working install in place
+  SIMD_WHEELS="$(mktemp -d)"
+  if pip wheel --no-deps pillow-simd -w "$SIMD_WHEELS"; then
+    # On a re-run, requirements.txt has just reinstalled Pillow over the
+    # Pillow-SIMD files that share its PIL package, so remove both and
+    # force the wheel in even though that version is already recorded
+    pip uninstall -y pillow pillow-simd
+    pip install --force-reinstall --no-deps "$SIMD_WHEELS"/*.whl
+  else
+    echo "Pillow-SIMD failed to build; keeping Pillow" >&2
+  fi
+  rm -rf "$SIMD_WHEELS"
+  unset CFLAGS
+fi
 #python3 weatherscreen.py
@@ -1,29 +1,61 @@
-from datetime import datetime, timezone
+import fcntl
+import logging
+import socket
+import struct
+import time
 from functools import lru_cache
-from threading import Thread
+from threading import Lock, Thread
+from typing import TYPE_CHECKING, Optional, Tuple
 
-from PIL import ImageFont
-from netifaces import interfaces, ifaddresses, AF_INET
+if TYPE_CHECKING:
+    from PIL import Image, ImageFont
+
+logger = logging.getLogger(__name__)
+
+SIOCGIFADDR = 0x8915
+
+
+def ipv4_addr(sock: socket.socket, ifname: str) -> str:
+    try:
+        ifreq = fcntl.ioctl(
+            sock.fileno(), SIOCGIFADDR, struct.pack("256s", ifname.encode())
+        )
+    except OSError:
+        return "No IP addr"
+    # struct ifreq: 16-byte name, then a sockaddr_in whose address starts
+    # after the 2-byte family and 2-byte port
+    return socket.inet_ntoa(ifreq[20:24])
 
 
 @lru_cache()
-def ip_str():
-    print("Working out ip addresses...")
+def _ip_str() -> Tuple[str, ...]:
+    logger.info("Working out ip addresses...")
     ip_str_lines = []
-    for ifaceName in interfaces():
-        addresses = [
-            i["addr"]
-            for i in ifaddresses(ifaceName).setdefault(
-                AF_INET, [{"addr": "No IP addr"}]
-            )
-        ]
-        ip_str_lines.append(f"{ifaceName}: {' '.join(addresses)}")
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        for _, ifname in socket.if_nameindex():
+            ip_str_lines.append(f"{ifname}: {ipv4_addr(sock, ifname)}")
+
+    logger.info("\n".join(ip_str_lines))
+    return tuple(ip_str_lines)
+
+
+_ip_str_lock = Lock()
 
-    print("\n".join(ip_str_lines))
-    return ip_str_lines
 
+def ip_str() -> Tuple[str, ...]:
+    # Serialised so that a caller arriving while the startup prefetch is
+    # still running waits for its result, rather than walking the
+    # interfaces a second time.
+    with _ip_str_lock:
+        return _ip_str()
 
-Thread(target=ip_str).run()
+
+def refresh_ip_str():
+    _ip_str.cache_clear()
+
+
+def prefetch_ip_str():
+    Thread(target=ip_str, daemon=True).start()
 
 
 class Color:
@@ -32,15 +64,60 @@ class Color:
     WHITE = (255, 255, 255)
 
 
+@lru_cache(maxsize=128)
 def timestamp2str(dt: int, short: bool = False) -> str:
     if short:
         fmt = "%H:%M %a"
     else:
         fmt = "%a %d %b, %H:%M %Z"
 
-    return (
-        datetime.fromtimestamp(dt, tz=timezone.utc).astimezone().strftime(fmt)
+    # time.localtime goes straight to libc, which keeps the zone loaded and
+    # still applies the right DST offset to each timestamp.
+    return time.strftime(fmt, time.localtime(dt))
+
+
+@lru_cache(maxsize=256)
+def text_mask(
+    font: "ImageFont.FreeTypeFont", text: str, anchor: Optional[str] = None
+) -> Tuple["Image.Image", Tuple[int, int]]:
+    from PIL import Image, ImageDraw
+
+    left, top, right, bottom = font.getbbox(text, anchor=anchor)
+    mask = Image.new("L", (right - left, bottom - top))
+    ImageDraw.Draw(mask).text(
+        xy=(-left, -top), text=text, fill=255, font=font, anchor=anchor
     )
+    return mask, (left, top)
+
+
+def blit_text(
+    image: "Image.Image",
+    xy: Tuple[float, float],
+    text: str,
+    fill: Tuple[int, int, int],
+    font: "ImageFont.FreeTypeFont",
+    anchor: Optional[str] = None,
+):
+    # Same result as ImageDraw.text, but the rasterised glyphs are cached,
+    # so a label that is drawn again is just a masked fill.
+    mask, (left, top) = text_mask(font, text, anchor)
+    x, y = int(xy[0]) + left, int(xy[1]) + top
+    image.paste(fill, box=(x, y, x + mask.width, y + mask.height), mask=mask)
+
+
+def rgb565(image: "Image.Image", rotation: int = 0) -> bytes:
+    # Packs an RGB image into the big-endian RGB565 pixel stream that the
+    # ST7789 expects, in one pass with a single widening copy.
+    import numpy
+
+    pixels = numpy.asarray(image, dtype=numpy.uint16)
+    pixels = numpy.rot90(pixels, rotation // 90)
+    packed = (
+        ((pixels[..., 0] & 0xF8) << 8)
+        | ((pixels[..., 1] & 0xFC) << 3)
+        | (pixels[..., 2] >> 3)
+    )
+    return packed.astype(">u2").tobytes()
 
 
 class Led:
@@ -49,13 +126,22 @@ class Led:
     RED = (0.1, 0, 0)
 
 
-try:
-    font = ImageFont.truetype(
-        "/usr/share/fonts/truetype/freefont/FreeMono.ttf", 20
-    )
-    smallfont = ImageFont.truetype(
-        "/usr/share/fonts/truetype/freefont/FreeMono.ttf", 12
-    )
-except OSError:
-    font = ImageFont.load_default()
-    smallfont = ImageFont.load_default()
+FONT_PATH = "/usr/share/fonts/truetype/freefont/FreeMono.ttf"
+
+
+@lru_cache()
+def get_fonts():
+    # Loaded on first use, so that importing utils doesn't pay for PIL
+    from PIL import ImageFont
+
+    try:
+        # Every label is short left-to-right Latin text, which doesn't need
+        # Raqm's complex shaping
+        font = ImageFont.truetype(
+            FONT_PATH, 20, layout_engine=ImageFont.Layout.BASIC
+        )
+        smallfont = font.font_variant(size=12)
+    except OSError:
+        font = ImageFont.load_default()
+        smallfont = ImageFont.load_default()
+    return font, smallfont
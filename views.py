@@ -1,7 +1,10 @@
+import logging
+import time
 from abc import abstractmethod, ABC
-from datetime import datetime, timezone
 
-from utils import Led, Color, ip_str, smallfont, font
+from utils import Led, Color, ip_str, refresh_ip_str, get_fonts, blit_text
+
+logger = logging.getLogger(__name__)
 
 
 class View(ABC):
@@ -34,26 +37,20 @@ class View(ABC):
         pass
 
     loop_period = 3600
+    # Fraction by which each loop period may randomly vary
+    loop_jitter = 0.0
 
 
 class PageView(View):
     @staticmethod
     def render(app):
-        print("Page view, idx", app.fidx)
-        try:
-            app.update_current_weather()
-            app.update_forecasts()
-        except Exception as exc:
-            app.handle(exc)
+        logger.debug("Page view, idx %d", app.fidx)
+        app.refresh()
 
         weathers = [app.current_weather, *app.forecasts]
 
-        app.paint_weather(weathers[app.fidx])
-        app.draw.text(
-            xy=(0, 0),
-            text="Current" if app.fidx == 0 else "Forecast",
-            fill=Color.WHITE,
-            font=font,
+        app.paint_weather(
+            weathers[app.fidx], "Current" if app.fidx == 0 else "Forecast"
         )
 
     @staticmethod
@@ -78,19 +75,17 @@ class PageView(View):
     def loop(app):
         app.loadview(PageView)
 
+    # OpenWeatherMap updates the current weather about every ten minutes
+    loop_period = 600
+    loop_jitter = 0.1
+
 
 class FourView(View):
     @staticmethod
     def render(app):
         width, height = app.displayhatmini.WIDTH, app.displayhatmini.HEIGHT
-        print("Four view, idx", app.fidx)
-        try:
-            app.displayhatmini.set_led(*Led.YELLOW)
-            app.update_current_weather()
-            app.update_forecasts()
-            app.displayhatmini.set_led(*Led.OFF)
-        except Exception as exc:
-            app.handle(exc)
+        logger.debug("Four view, idx %d", app.fidx)
+        app.refresh()
 
         xys = [
             (0, 0),
@@ -128,28 +123,42 @@ class FourView(View):
     def loop(app):
         app.loadview(FourView)
 
+    loop_period = PageView.loop_period
+    loop_jitter = PageView.loop_jitter
+
 
 class ErrorsView(View):
     @staticmethod
     def render(app):
-        print("Errors view")
+        logger.debug("Errors view")
+        font, smallfont = get_fonts()
         app.displayhatmini.set_led(*Led.OFF)
         app.clear()
+        app.clock_str = None
 
         if app.errors:
-            app.draw.text(xy=(0, 0), text="Errors", fill=Color.RED, font=font)
+            blit_text(
+                app.buffer, xy=(0, 0), text="Errors", fill=Color.RED, font=font
+            )
             y = 20
             for exc in app.errors:
-                print(str(exc))
-                app.draw.text(
-                    xy=(20, y), text=str(exc), fill=Color.RED, font=font
+                blit_text(
+                    app.buffer,
+                    xy=(20, y),
+                    text=str(exc),
+                    fill=Color.RED,
+                    font=font,
                 )
                 y += 20
-            app.errors = []
+            app.errors.clear()
 
         else:
-            app.draw.text(
-                xy=(0, 0), text="No errors!", fill=Color.WHITE, font=font
+            blit_text(
+                app.buffer,
+                xy=(0, 0),
+                text="No errors!",
+                fill=Color.WHITE,
+                font=font,
             )
 
         y = app.displayhatmini.HEIGHT - 60
@@ -158,19 +167,32 @@ class ErrorsView(View):
         lines = ip_str()
         app.displayhatmini.set_led(*Led.OFF)
         for line in lines:
-            app.draw.text(
-                xy=(10, y), text=line, fill=Color.WHITE, font=smallfont
+            blit_text(
+                app.buffer,
+                xy=(10, y),
+                text=line,
+                fill=Color.WHITE,
+                font=smallfont,
             )
             y += 20
 
     @staticmethod
     def update_time(app):
+        # A tick can still arrive after another view has been loaded
+        if app.view is not ErrorsView:
+            return
         width, height = app.displayhatmini.WIDTH, app.displayhatmini.HEIGHT
-        timestr = datetime.now(tz=timezone.utc).astimezone().strftime("%H:%M:%S")
-        app.draw.rectangle(
-            xy=(0, height // 2 - 20, width, height // 2 + 10),
-            fill=Color.BLACK,
-        )
+        font, _ = get_fonts()
+        # The clock string is different every tick, so caching its glyphs
+        # (blit_text) would only push the static labels out of the cache.
+        timestr = time.strftime("%H:%M:%S")
+        # Ticks come twice a second but the text only changes once
+        if timestr == app.clock_str:
+            return
+        app.clock_str = timestr
+
+        box = (0, height // 2 - 20, width, height // 2 + 10)
+        app.buffer.paste(Color.BLACK, box=box)
         app.draw.text(
             xy=(width // 2, height // 2),
             text=timestr,
@@ -186,7 +208,7 @@ class ErrorsView(View):
 
     @staticmethod
     def buttonB(app):
-        ip_str.cache_clear()
+        refresh_ip_str()
         app.loadview(ErrorsView)
 
     @staticmethod
@@ -1,58 +1,140 @@
 import logging
+import random
 import time
-from threading import Timer
-from typing import Any, Dict, List
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from threading import Event, Lock
+from typing import Any, Deque, Dict, Optional
 
-from PIL import Image, ImageDraw
+from PIL import Image, ImageChops, ImageDraw
 from displayhatmini import DisplayHATMini
 from dotenv import load_dotenv
 
 from openweathermap import OpenWeatherMap
-from utils import Led, Color, timestamp2str, font
-from views import ErrorsView
+from utils import (
+    Led,
+    Color,
+    timestamp2str,
+    blit_text,
+    rgb565,
+    get_fonts,
+    prefetch_ip_str,
+)
+from views import ErrorsView, FourView, PageView
 
 logger = logging.getLogger()
+logging.basicConfig(level=logging.INFO)
 
 load_dotenv()
-owm = OpenWeatherMap()
+# Keep the current weather for just under the shortest jittered loop period
+# of the weather views, so that each of their ticks fetches afresh
+owm = OpenWeatherMap(
+    current_ttl=min(
+        view.loop_period * (1 - view.loop_jitter)
+        for view in (PageView, FourView)
+    )
+)
 
 width = DisplayHATMini.WIDTH
 height = DisplayHATMini.HEIGHT
 
+# Position of each button's handler in the dispatch tuple built by loadview
+_PIN_INDEX = {
+    DisplayHATMini.BUTTON_A: 0,
+    DisplayHATMini.BUTTON_B: 1,
+    DisplayHATMini.BUTTON_X: 2,
+    DisplayHATMini.BUTTON_Y: 3,
+}
+
 
 class CallbackHandler:
+    # Presses of the same button closer together than this are contact
+    # bounce, not the user pressing again
+    DEBOUNCE = 0.02
+
     def __init__(self, app):
         self.app = app
         self.action = lambda pin: None
+        self._last_press: Dict[int, float] = {}
 
     def act(self, pin):
+        now = time.monotonic()
+        if now - self._last_press.get(pin, float("-inf")) < self.DEBOUNCE:
+            return
+        self._last_press[pin] = now
         self.action(pin)
 
 
+# Runs the current view's loop action every period on the main thread,
+# blocking on an Event in between rather than spinning.
 class LoopHandler:
-    def __init__(self, app, action=None, period=1):
+    def __init__(self, app, action=None, period=1, jitter=0.0):
         self.app = app
         self.action = action
         self.period = period
+        self.jitter = jitter
+        self.rescheduled = Event()
 
-    def act(self):
-        if self.action is not None:
-            try:
-                self.action(self.app)
-            except Exception as exc:
-                self.app.handle(exc)
-
-        Timer(self.period, self.act).start()
+    def reschedule(self, action, period, jitter=0.0):
+        # Reloading the view that is already showing (as PageView.loop does)
+        # keeps the existing schedule
+        if (action, period, jitter) == (self.action, self.period, self.jitter):
+            return
+        self.action = action
+        self.period = period
+        self.jitter = jitter
+        self.rescheduled.set()
+
+    def next_period(self) -> float:
+        # Each period is stretched or shrunk by up to the jitter fraction,
+        # so that polls don't fall into lockstep with the API's updates
+        return self.period * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def run(self):
+        deadline = time.monotonic() + self.next_period()
+        while True:
+            timeout = max(0.0, deadline - time.monotonic())
+            # If a new view was loaded, start counting its period afresh
+            if self.rescheduled.wait(timeout=timeout):
+                self.rescheduled.clear()
+                deadline = time.monotonic() + self.next_period()
+                continue
+
+            if self.action is not None:
+                try:
+                    self.action(self.app)
+                except Exception as exc:
+                    self.app.handle(exc)
+
+            # Step on from the previous deadline rather than from now, so
+            # that the time taken by the action doesn't accumulate as drift.
+            # Ticks missed while the action overran are skipped.
+            deadline += self.next_period()
+            now = time.monotonic()
+            while deadline <= now:
+                deadline += self.next_period()
 
 
 class App:
     def __init__(self):
-        print("Initializing app...")
-        self.errors: List[Exception] = []
+        logger.info("Initializing app...")
+        prefetch_ip_str()
+        # Only the most recent errors are kept, in case the network is down
+        # for a long time
+        self.errors: Deque[Exception] = deque(maxlen=50)
 
         self.buffer = Image.new("RGB", (width, height))
         self.draw = ImageDraw.Draw(self.buffer)
 
+        self._static_layer = Image.new("RGB", (width, height))
+        self._static_key = None
+        # The static layer key that the buffer currently holds, if any
+        self._painted_key = None
+
+        # A copy of what the display is currently showing
+        self._shown: Optional[Image.Image] = None
+        self._redraw_lock = Lock()
+
         self.displayhatmini = DisplayHATMini(
             buffer=self.buffer, backlight_pwm=True
         )
@@ -65,49 +147,121 @@ class App:
 
         self.current_weather = None
         self.forecasts = []
-        self.last_update_forecasts: float = 0
         self.fidx: int = 0
+        self.clock_str: Optional[str] = None
+        self.view = None
+
+        # Used to fetch the current weather and the forecasts concurrently.
+        self.executor = ThreadPoolExecutor(max_workers=2)
 
         self.loop_handler = LoopHandler(self)
-        self.loop_handler.act()
 
         self.loadview(ErrorsView)
 
     def handle(self, exc: Exception):
-        logger.exception(exc)
+        logger.error(exc, exc_info=exc)
+        # The traceback has been logged; don't keep its frames alive too
+        exc.__traceback__ = None
         self.errors.append(exc)
         self.displayhatmini.set_led(*Led.RED)
 
     def clear(self):
-        self.draw.rectangle(xy=((0, 0), (width, height)), fill=Color.BLACK)
+        self.buffer.paste(Color.BLACK, box=(0, 0, width, height))
 
     def redraw(self):
-        self.displayhatmini.display()
+        # Button presses and the loop both push frames, from different
+        # threads; interleaved window and data writes would corrupt the
+        # panel and leave _shown out of step with it.
+        with self._redraw_lock:
+            self._push()
+
+    def _push(self):
+        # Only send the part of the frame that has changed since the last
+        # push; skip the push completely if nothing has.
+        if self._shown is None:
+            box = (0, 0, width, height)
+        else:
+            box = ImageChops.difference(self.buffer, self._shown).getbbox()
+            if box is None:
+                return
+
+        # The partial push relies on the window and rotation handling of
+        # the current ST7789 driver; anything else gets the driver's own
+        # full-frame display().
+        st7789 = self.displayhatmini.st7789
+        rotation = getattr(st7789, "_rotation", None)
+        if rotation not in (0, 180) or not hasattr(st7789, "set_window"):
+            self.displayhatmini.display()
+            self._shown = self.buffer.copy()
+            return
+        region = self.buffer.crop(box)
+
+        x0, y0, x1, y1 = box
+        if rotation == 180:
+            # The driver rotates the frame in software, so the window has
+            # to be mirrored in both directions too.
+            x0, y0, x1, y1 = width - x1, height - y1, width - x0, height - y0
+
+        st7789.set_window(x0, y0, x1 - 1, y1 - 1)
+        st7789.data(rgb565(region, rotation))
+
+        if self._shown is None:
+            self._shown = self.buffer.copy()
+        else:
+            self._shown.paste(region, box=box)
+
+    def paint_weather(self, weather: Dict[str, Any], label: str):
+        # Keyed on exactly what _compose_static draws
+        key = (
+            weather["_tempstr"],
+            weather["_feelstr"],
+            weather["_timestr"],
+            weather["icon"],
+            weather.get("name"),
+            label,
+        )
+        # Nothing else draws into the buffer while the same view stays
+        # loaded, so if it already holds this weather there's nothing to do
+        if key == self._painted_key:
+            return
 
-    def paint_weather(self, weather: Dict[str, Any]):
-        self.clear()
+        if key != self._static_key:
+            self._compose_static(weather, label)
+            self._static_key = key
 
-        icon = owm.icon(weather["weather"][0]["icon"]).resize((150, 150))
-        self.buffer.paste(
-            icon,
-            box=(width // 2 - 75, 40),
-            mask=icon,
+        self.buffer.paste(self._static_layer)
+        self._painted_key = key
+
+    def _compose_static(self, weather: Dict[str, Any], label: str):
+        # Everything that paint_weather shows depends only on the weather
+        # and the label, so it is drawn once per weather onto the static
+        # layer.
+        font, _ = get_fonts()
+        self._static_layer.paste(Color.BLACK, box=(0, 0, width, height))
+
+        blit_text(
+            self._static_layer,
+            xy=(0, 0),
+            text=label,
+            fill=Color.WHITE,
+            font=font,
         )
 
-        temp = weather["main"]["temp"]
-        feels_like = weather["main"]["feels_like"]
-        humidity = weather["main"]["humidity"]
+        icon = owm.icon(weather["icon"], 150)
+        self._static_layer.paste(icon, box=(width // 2 - 75, 40))
 
-        self.draw.text(
+        blit_text(
+            self._static_layer,
             xy=(width // 2, 25),
-            text=f"{temp:.1f} °C, {humidity:.0f}% 💧",
+            text=weather["_tempstr"],
             anchor="mt",
             fill=Color.WHITE,
             font=font,
         )
-        self.draw.text(
+        blit_text(
+            self._static_layer,
             xy=(width // 2, 45),
-            text=f"(feels like {feels_like:.1f} °C)",
+            text=weather["_feelstr"],
             anchor="mt",
             fill=Color.WHITE,
             font=font,
@@ -115,94 +269,140 @@ class App:
 
         location = weather.get("name")
         if location is not None:
-            self.draw.text(
-                xy=(width - font.getlength(location), 0),
+            blit_text(
+                self._static_layer,
+                xy=(width, 0),
                 text=location,
+                anchor="ra",
                 fill=Color.WHITE,
                 font=font,
             )
 
-        timestr = timestamp2str(weather["dt"])
-        self.draw.text(
-            xy=(width - font.getlength(timestr), height - 20),
+        timestr = weather["_timestr"]
+        blit_text(
+            self._static_layer,
+            xy=(width, height - 20),
             text=timestr,
+            anchor="ra",
             fill=Color.RED,
             font=font,
         )
 
-    def update_current_weather(self):
-        if (
-            self.current_weather is not None
-            and (time.time() - self.current_weather["dt"]) < 60
-        ):
-            print("Skipping current weather update...")
-            return
+    @staticmethod
+    def prepare(weather: Dict[str, Any]) -> Dict[str, Any]:
+        # Format the display strings once, when the weather arrives, rather
+        # than on every redraw.
+        temp = weather["temp"]
+        feels_like = weather["feels_like"]
+        humidity = weather["humidity"]
+        weather["_tempstr"] = f"{temp:.1f} °C, {humidity:.0f}% 💧"
+        weather["_tempstr_short"] = f"{temp:.1f} °C, {humidity:.0f}%"
+        weather["_feelstr"] = f"(feels like {feels_like:.1f} °C)"
+        weather["_timestr"] = timestamp2str(weather["dt"])
+        weather["_timestr_short"] = timestamp2str(weather["dt"], short=True)
+        return weather
 
-        print("Updating current weather...")
-        self.displayhatmini.set_led(*Led.YELLOW)
-        self.current_weather = owm.current()
-        self.displayhatmini.set_led(*Led.OFF)
+    def update_current_weather(self):
+        logger.debug("Updating current weather...")
+        current_weather = owm.current()
+        # owm hands back the same object until its cache expires
+        if current_weather is not self.current_weather:
+            self.current_weather = self.prepare(current_weather)
 
     def update_forecasts(self):
-        if self.forecasts and self.last_update_forecasts >= time.time() - 3600:
-            print("Skipping forecast update...")
-            return
-
-        print("Updating forecasts...")
+        logger.debug("Updating forecasts...")
+        forecasts = owm.forecasts()
+        if forecasts is not self.forecasts:
+            for forecast in forecasts:
+                self.prepare(forecast)
+            self.forecasts = forecasts
+
+    def refresh(self):
+        # The LED stays lit until both fetches have finished
         self.displayhatmini.set_led(*Led.YELLOW)
-        self.forecasts = owm.forecasts()
-        self.last_update_forecasts = time.time()
+        futures = [
+            self.executor.submit(self.update_current_weather),
+            self.executor.submit(self.update_forecasts),
+        ]
+        wait(futures)
         self.displayhatmini.set_led(*Led.OFF)
 
+        # One failed fetch doesn't stop the other from being shown, and
+        # each failure is reported
+        for future in futures:
+            exc = future.exception()
+            if exc is not None:
+                self.handle(exc)
+
     def loadview(self, viewcls):
-        print("loading", viewcls)
-        viewcls.render(self)
+        logger.debug("loading %s", viewcls.__name__)
+        previous_view = self.view
+        loop = self.loop_handler
+        previous_loop = (loop.action, loop.period, loop.jitter)
+        if viewcls is not self.view:
+            # The previous view may have drawn over the weather
+            self._painted_key = None
+            self.view = viewcls
+        # Switch the loop over before rendering, which may wait on the
+        # network, so that the old view's loop can't draw over this one
+        loop.reschedule(viewcls.loop, viewcls.loop_period, viewcls.loop_jitter)
+        try:
+            viewcls.render(self)
+        except Exception:
+            # Leave the previous view in place, as the panel still shows it
+            self.view = previous_view
+            loop.reschedule(*previous_loop)
+            with self._redraw_lock:
+                if self._shown is not None:
+                    self.buffer.paste(self._shown)
+            self._painted_key = None
+            raise
+
+        dispatch = (
+            viewcls.buttonA,
+            viewcls.buttonB,
+            viewcls.buttonX,
+            viewcls.buttonY,
+        )
 
         def button_callback(pin):
             if not self.displayhatmini.read_button(pin):
                 return
 
-            {
-                DisplayHATMini.BUTTON_A: viewcls.buttonA,
-                DisplayHATMini.BUTTON_B: viewcls.buttonB,
-                DisplayHATMini.BUTTON_X: viewcls.buttonX,
-                DisplayHATMini.BUTTON_Y: viewcls.buttonY,
-            }[pin](self)
+            dispatch[_PIN_INDEX[pin]](self)
 
         self.button_handler.action = button_callback
-        self.loop_handler.action = viewcls.loop
-        self.loop_handler.period = viewcls.loop_period
 
         self.redraw()
 
     def paint_weather_small(self, weather, xy):
+        # Drawn straight into the frame; the caller has already cleared it
+        font, _ = get_fonts()
         hw = width // 2
         hh = height // 2
-        mini = Image.new("RGBA", (hw, hh), Color.BLACK)
-        minidraw = ImageDraw.Draw(mini)
-        icon = owm.icon(weather["weather"][0]["icon"]).resize((80, 80))
-        mini.paste(icon, box=(hw // 2 - 40, hh // 2 - 40), mask=icon)
-        timestr = timestamp2str(weather["dt"], short=True)
-        minidraw.text(
-            xy=((hw - font.getlength(timestr)) // 2, 20),
+        ox, oy = xy
+        icon = owm.icon(weather["icon"], 80)
+        self.buffer.paste(icon, box=(ox + hw // 2 - 40, oy + hh // 2 - 40))
+        timestr = weather["_timestr_short"]
+        blit_text(
+            self.buffer,
+            xy=(ox + hw // 2, oy + 20),
             text=timestr,
+            anchor="ma",
             fill=Color.WHITE,
             font=font,
         )
 
-        tempstr = f'{weather["main"]["temp"]:.1f} °C, {weather["main"]["humidity"]:.0f}%'
-        minidraw.text(
-            xy=((hw - font.getlength(tempstr)) // 2, hh - 30),
+        tempstr = weather["_tempstr_short"]
+        blit_text(
+            self.buffer,
+            xy=(ox + hw // 2, oy + hh - 30),
             text=tempstr,
+            anchor="ma",
             fill=Color.WHITE,
             font=font,
         )
 
-        self.buffer.paste(mini, box=xy, mask=mini)
-
 
 app = App()
-
-while True:
-    pass
-    # time.sleep(1.0 / 30)
+app.loop_handler.run()